@@ -1,40 +1,27 @@
 import streamlit as st
-import pandas as pd
-from sqlalchemy import create_engine, Column, Integer, String, ForeignKey, Boolean, DateTime, BigInteger
-from sqlalchemy.orm import declarative_base, sessionmaker, relationship, joinedload
-from datetime import datetime, date, time as dt_time
+import numpy as np
+from finance_kernels import distribute_core, simplify_core
+from sqlalchemy import create_engine, select, update, func, cast, Column, Integer, String, ForeignKey, Boolean, DateTime, BigInteger, Index
+from sqlalchemy.pool import NullPool
+from sqlalchemy.orm import declarative_base, sessionmaker, scoped_session, relationship, selectinload, raiseload
+from datetime import datetime
 import uuid
-import collections
-import heapq
+import os
 import time
 
-# ==========================================
-# 🚀 数据库连接优化版 (带缓存)
-# ==========================================
-@st.cache_resource(ttl="2h")
-def get_db_engine():
-    # 1. 优先尝试从云端 Secrets 获取
-    db_url = st.secrets.get("DATABASE_URL")
-    
-    # 2. 如果没有云端配置，回退到本地 SQLite (方便你在自己电脑调试)
-    if not db_url:
-        return create_engine('sqlite:///splitwise_pro.db', connect_args={'check_same_thread': False})
-
-    # 3. 修正 Supabase 链接格式
-    if db_url.startswith("postgres://"):
-        db_url = db_url.replace("postgres://", "postgresql://", 1)
-    
-    # 4. 创建连接池 (优化并发)
-    return create_engine(db_url, pool_pre_ping=True, pool_size=5, max_overflow=10)
-
-# 获取带缓存的 engine
-engine = get_db_engine()
-
 # ==========================================
 # 🏗️ 1. 底层架构 (Database Models)
 # ==========================================
 Base = declarative_base()
 
+def new_id():
+    # UUIDv7 格式的主键：高 48 位是毫秒时间戳，按时间递增，新行追加在主键索引末尾，
+    # 不像 uuid4 那样随机打散 B-tree 页；仍是 36 位字符串，老库的 String 列无需迁移
+    ms = time.time_ns() // 1_000_000
+    rand = int.from_bytes(os.urandom(10), "big")
+    value = (ms & 0xFFFFFFFFFFFF) << 80 | 0x7 << 76 | (rand >> 68) << 64 | 0b10 << 62 | (rand & 0x3FFFFFFFFFFFFFFF)
+    return str(uuid.UUID(int=value))
+
 class User(Base):
     __tablename__ = 'users'
     id = Column(String, primary_key=True)
@@ -48,6 +35,7 @@ class Group(Base):
     created_at = Column(DateTime, default=datetime.now)
     is_deleted = Column(Boolean, default=False)
     members = relationship("GroupMember", back_populates="group", cascade="all, delete")
+    __table_args__ = (Index("ix_groups_active", "is_deleted"),)
 
 class GroupMember(Base):
     __tablename__ = 'group_members'
@@ -56,6 +44,7 @@ class GroupMember(Base):
     user_id = Column(String, ForeignKey('users.id'))
     group = relationship("Group", back_populates="members")
     user = relationship("User")
+    __table_args__ = (Index("ix_group_members_group_user", "group_id", "user_id"),)
 
 class Expense(Base):
     __tablename__ = 'expenses'
@@ -69,6 +58,8 @@ class Expense(Base):
     is_deleted = Column(Boolean, default=False)
     splits = relationship("Split", back_populates="expense", cascade="all, delete")
     creator = relationship("User")
+    # 覆盖仪表盘的 group_id + is_deleted 过滤和按日期倒序
+    __table_args__ = (Index("ix_expenses_group_active_date", "group_id", "is_deleted", "date"),)
 
 class Split(Base):
     __tablename__ = 'splits'
@@ -79,137 +70,242 @@ class Split(Base):
     owed_amount = Column(BigInteger, default=0)
     expense = relationship("Expense", back_populates="splits")
     user = relationship("User")
+    __table_args__ = (Index("ix_splits_expense", "expense_id"),)
+
+# ==========================================
+# 🚀 数据库连接优化版 (带缓存)
+# ==========================================
+def _create_engine():
+    # 1. 优先尝试从云端 Secrets 获取
+    db_url = st.secrets.get("DATABASE_URL")
+    
+    # 2. 如果没有云端配置，回退到本地 SQLite (方便你在自己电脑调试)
+    #    NullPool: 每次用完即关，不让多个线程各自攥着池里的连接抢文件锁
+    if not db_url:
+        return create_engine('sqlite:///splitwise_pro.db', connect_args={'check_same_thread': False}, poolclass=NullPool)
+
+    # 3. 修正 Supabase 链接格式
+    if db_url.startswith("postgres://"):
+        db_url = db_url.replace("postgres://", "postgresql://", 1)
+    
+    # 4. 创建连接池 (优化并发)；定期回收连接，避开 Supabase 对空闲连接的强制断开
+    return create_engine(db_url, pool_pre_ping=True, pool_size=5, max_overflow=10, pool_recycle=1800)
+
+# 建表、补索引、建 session 工厂都只在每个进程里做一次，不随每次 rerun 重复探测远端数据库
+@st.cache_resource(ttl="2h")
+def get_db_engine():
+    engine = _create_engine()
 
-# 初始化表结构
-Base.metadata.create_all(engine)
-Session = sessionmaker(bind=engine)
-session = Session() # 注意：为了代码简单，这里保留全局session，但在Service中尽量使用短生命周期session
+    # 初始化表结构
+    Base.metadata.create_all(engine)
+
+    # 已部署的老库里表已存在，create_all 不会补建索引，这里补建
+    if engine.dialect.name in ("postgresql", "sqlite"):
+        with engine.begin() as conn:
+            for table in Base.metadata.sorted_tables:
+                for idx in table.indexes:
+                    idx.create(conn, checkfirst=True)
+
+    # 每个线程一个 session (Streamlit 多线程跑脚本)，Service 里用 with 开短生命周期 session；
+    # expire_on_commit=False 让提交后返回的对象在 UI 里仍可直接读取
+    return engine, scoped_session(sessionmaker(bind=engine, expire_on_commit=False))
+
+# 获取带缓存的 engine 和 session 工厂
+engine, Session = get_db_engine()
 
 # ==========================================
 # 🧠 2. 核心财务引擎
 # ==========================================
-class FinanceEngine:
-    @staticmethod
-    def to_cents(amount_float): return int(round(amount_float * 100))
-    @staticmethod
-    def to_dollars(amount_int): return amount_int / 100.0
+# 金额换算是渲染循环里的高频调用，做成模块级函数省掉 staticmethod 的属性查找
+def to_cents(amount_float): return int(round(amount_float * 100))
+def to_dollars(amount_int): return amount_int / 100.0
+# 批量版：一次把整列分转成元字符串，格式与 str(to_dollars(x)) 完全一致
+def to_dollars_array(amounts): return (np.asarray(amounts, dtype=np.int64) / 100.0).astype(str)
 
+class FinanceEngine:
     @staticmethod
     def distribute_amount(total_cents, weights):
-        total_weight = sum(weights)
-        if total_weight == 0: return [0] * len(weights)
-        
-        amounts = []
-        current_sum = 0
-        for w in weights:
-            share = int((total_cents * w) / total_weight)
-            amounts.append(share)
-            current_sum += share
-            
-        remainder = total_cents - current_sum
-        for i in range(remainder):
-            amounts[i] += 1
-        return amounts
+        w = np.asarray(weights, dtype=np.int64)
+        if w.sum() == 0: return [0] * len(weights)
+        return distribute_core(np.int64(total_cents), w).tolist()
 
     @staticmethod
-    def simplify_debts(net_balances):
-        debtors = []
-        creditors = []
-        for person, amount in net_balances.items():
-            if amount < -1: heapq.heappush(debtors, (amount, person))
-            elif amount > 1: heapq.heappush(creditors, (-amount, person))
-        
-        transactions = []
-        while debtors and creditors:
-            debt_amt, debtor = heapq.heappop(debtors)
-            credit_amt, creditor = heapq.heappop(creditors)
-            amount = min(-debt_amt, -credit_amt)
-            transactions.append({"from": debtor, "to": creditor, "amount": amount})
-            
-            remain_debt = debt_amt + amount
-            remain_credit = credit_amt + amount
-            
-            if remain_debt < -1: heapq.heappush(debtors, (remain_debt, debtor))
-            if remain_credit < -1: heapq.heappush(creditors, (remain_credit, creditor))
-        return transactions
+    def simplify_debts(names, balances):
+        # names / balances 为平行数组 (按名字排序)，内核只处理 int64 分
+        if not names: return []
+        from_idx, to_idx, amounts = simplify_core(balances)
+        amount_strs = to_dollars_array(amounts)
+        return [{"from": names[f], "to": names[t], "amount": int(a), "amount_str": a_str}
+                for f, t, a, a_str in zip(from_idx, to_idx, amounts, amount_strs.tolist())]
 
 # ==========================================
 # 🛠️ 3. 业务服务层 (带缓存清理)
 # ==========================================
 def clear_cache():
     st.cache_data.clear()
+    _dashboard.clear() # 仪表盘整批数据在 cache_resource 里，要单独清
+
+# 成员和群组列表很少变动，每次 rerun 都要用：缓存成纯 dict，写操作里的 clear_cache() 会一并清掉
+@st.cache_data(ttl="5m", max_entries=64, show_spinner=False)
+def _all_users_cached():
+    # 只要 id 和 username 两列，不实例化 User 对象
+    with engine.connect() as conn:
+        return [{"id": row.id, "username": row.username} for row in conn.execute(select(User.id, User.username)).all()]
+
+@st.cache_data(ttl="5m", max_entries=64, show_spinner=False)
+def _active_groups_cached():
+    with Session() as local_session:
+        groups = local_session.query(Group).filter_by(is_deleted=False).options(selectinload(Group.members).selectinload(GroupMember.user), raiseload('*')).all()
+        return [{
+            "id": g.id,
+            "name": g.name,
+            # 下拉框和提交时要用的成员列表 / 名字→id 映射在这里算好，UI 直接读
+            "member_names": [m.user.username for m in g.members],
+            "member_ids": {m.user.username: m.user.id for m in g.members},
+        } for g in groups]
 
 class GroupService:
     @staticmethod
     def create_group(name, user_ids):
-        local_session = Session()
+        # begin() 块正常结束即提交，抛异常自动回滚
         try:
-            grp = Group(id=str(uuid.uuid4()), name=name)
-            local_session.add(grp)
-            for uid in user_ids:
-                local_session.add(GroupMember(group_id=grp.id, user_id=uid))
-            local_session.commit()
-            clear_cache()
-            return True, "创建成功"
+            with Session() as local_session, local_session.begin():
+                grp = Group(id=new_id(), name=name)
+                local_session.add(grp)
+                local_session.flush() # 先写入 Group，保证外键存在
+                if user_ids: local_session.execute(GroupMember.__table__.insert(), [{"group_id": grp.id, "user_id": uid} for uid in user_ids])
         except Exception as e:
-            local_session.rollback()
             return False, str(e)
-        finally:
-            local_session.close()
+        clear_cache()
+        return True, "创建成功"
 
     @staticmethod
     def delete_group(group_id):
-        local_session = Session()
-        try:
-            grp = local_session.query(Group).filter_by(id=group_id).first()
-            if grp:
-                grp.is_deleted = True
-                local_session.commit()
-                clear_cache()
-                return True
-            return False
-        finally:
-            local_session.close()
+        # 软删除直接 UPDATE ... WHERE，不先 SELECT 一遍
+        with Session() as local_session, local_session.begin():
+            res = local_session.execute(update(Group).where(Group.id == group_id).values(is_deleted=True))
+        if res.rowcount == 0: return False
+        clear_cache()
+        return True
 
     @staticmethod
-    # 缓存群组列表查询，减少数据库压力
     def get_active_groups():
-        local_session = Session()
-        try:
-            return local_session.query(Group).filter_by(is_deleted=False).options(joinedload(Group.members).joinedload(GroupMember.user)).all()
-        finally:
-            local_session.close()
+        return _active_groups_cached()
+
+ACTIVITY_LIMIT = 50 # 每个群组最多展示的最近动态条数
+
+# 查询函数都按一批 group_id 取数，仪表盘所有群组一次查完
+def _query_balances(conn, group_ids):
+    # 返回 {group_id: (names, values)}：名字列表 + int64 余额 (分) 两个平行数组，直接喂给结算内核
+    # 直接在数据库里 GROUP BY 汇总，每个群组每个成员一行 (Postgres 的 SUM(bigint) 返回 numeric，转回整数分)
+    stmt = (select(Expense.group_id, User.username, cast(func.coalesce(func.sum(Split.paid_amount - Split.owed_amount), 0), BigInteger))
+            .select_from(Split)
+            .join(Expense, Split.expense_id == Expense.id)
+            .join(User, Split.user_id == User.id)
+            .where(Expense.group_id.in_(group_ids), Expense.is_deleted == False)
+            .group_by(Expense.group_id, User.username))
+    pairs = {gid: [] for gid in group_ids}
+    for gid, name, amount in conn.execute(stmt).all():
+        pairs[gid].append((name, amount))
+    result = {}
+    for gid, rows in pairs.items():
+        rows.sort()
+        result[gid] = ([name for name, _ in rows], np.array([amount for _, amount in rows], dtype=np.int64))
+    return result
+
+def _query_activity(conn, group_ids, limit=ACTIVITY_LIMIT):
+    # 只取需要的列，不实例化 ORM 对象；窗口函数按群组各取最近 limit 条
+    # 分摊明细用一条 IN 查询取回后按 expense_id 分组，展示用的字符串在这里一次拼好
+    rn = func.row_number().over(partition_by=Expense.group_id, order_by=Expense.date.desc()).label("rn")
+    recent = (select(Expense.id, Expense.group_id, Expense.description, Expense.amount, Expense.date, Expense.category,
+                     User.username.label("creator"), rn)
+              .join(User, Expense.created_by == User.id)
+              .where(Expense.group_id.in_(group_ids), Expense.is_deleted == False)
+              .subquery())
+    stmt = select(recent).where(recent.c.rn <= limit).order_by(recent.c.date.desc())
+    rows = conn.execute(stmt).all()
+
+    result = {gid: [] for gid in group_ids}
+    if not rows: return result
+
+    paid = {row.id: [] for row in rows}
+    owed = {row.id: [] for row in rows}
+    split_stmt = (select(Split.expense_id, User.username, Split.paid_amount, Split.owed_amount)
+                  .join(User, Split.user_id == User.id)
+                  .where(Split.expense_id.in_(list(paid)))
+                  .order_by(Split.id))
+    splits = conn.execute(split_stmt).all()
+    paid_strs = to_dollars_array([s.paid_amount or 0 for s in splits]).tolist()
+    owed_strs = to_dollars_array([s.owed_amount or 0 for s in splits]).tolist()
+    for s, p_str, o_str in zip(splits, paid_strs, owed_strs):
+        if s.paid_amount: paid[s.expense_id].append(f"{s.username}付{p_str}")
+        if s.owed_amount: owed[s.expense_id].append(f"{s.username}耗{o_str}")
+
+    amt_strs = to_dollars_array([row.amount for row in rows]).tolist()
+    # 时间同样整批格式化：datetime64[m] 截到分钟，等价于 strftime('%Y-%m-%d %H:%M')
+    minutes = np.array([row.date for row in rows], dtype="datetime64[m]")
+    time_strs = np.char.replace(np.datetime_as_string(minutes, unit="m"), "T", " ").tolist()
+    for row, amt_str, time_str in zip(rows, amt_strs, time_strs):
+        result[row.group_id].append({
+            "id": row.id,
+            "description": row.description,
+            "time_str": time_str,
+            "amt_str": amt_str,
+            "creator": row.creator,
+            "category": row.category,
+            "details": ", ".join(paid[row.id] + owed[row.id]),
+        })
+    return result
+
+# 读取走缓存：返回纯 Python/NumPy 结构，不带 ORM 对象；记账/删账时 clear_expense_cache() 会清掉
+# 纯查询直接走 Core 连接，不经过 ORM Session
+# 整批结果放 cache_resource：命中时直接拿同一个对象、不反序列化 (只读，不要原地修改)
+@st.cache_resource(ttl="5m", max_entries=64, show_spinner=False)
+def _dashboard(group_ids):
+    # 整个仪表盘一次取齐：所有群组的余额一条聚合查询，动态两条查询，而不是每个群组各查两次
+    with engine.connect() as conn:
+        balances = _query_balances(conn, group_ids)
+        activity = _query_activity(conn, group_ids)
+    # 结算建议只依赖余额，一并算好放进缓存，rerun 时不用再跑结算内核
+    return {gid: {"balances": balances[gid], "txs": FinanceEngine.simplify_debts(*balances[gid]), "activity": activity[gid]}
+            for gid in group_ids}
+
+@st.cache_data(ttl="5m", max_entries=256, show_spinner=False)
+def _dashboard_group(group_ids, group_id):
+    # 每张群组卡片只拷贝自己那一份，而不是每张卡片都反序列化一遍整个仪表盘
+    return _dashboard(group_ids).get(group_id)
+
+def clear_expense_cache():
+    # 记账/删账只影响余额和动态，成员、群组列表的缓存保留
+    _dashboard.clear(); _dashboard_group.clear()
 
 class ExpenseService:
     @staticmethod
     def create_expense(desc, total_cents, group_id, created_by, category, payer_splits, ower_splits, custom_time=None):
-        if abs(sum(payer_splits.values()) - total_cents) > 1 or abs(sum(ower_splits.values()) - total_cents) > 1:
+        paid_sum, owed_sum = sum(payer_splits.values()), sum(ower_splits.values())
+        if abs(paid_sum - total_cents) > 1 or abs(owed_sum - total_cents) > 1:
             return False, "账目不平"
 
-        local_session = Session()
         try:
-            exp_id = str(uuid.uuid4())
-            final_time = custom_time if custom_time else datetime.now()
+            with Session() as local_session, local_session.begin():
+                exp_id = new_id()
+                final_time = custom_time if custom_time else datetime.now()
             
-            expense = Expense(id=exp_id, description=desc, amount=total_cents, group_id=group_id, 
-                              created_by=created_by, category=category, date=final_time)
-            local_session.add(expense)
-
-            all_users = set(payer_splits.keys()) | set(ower_splits.keys())
-            for uid in all_users:
-                p = payer_splits.get(uid, 0)
-                o = ower_splits.get(uid, 0)
-                if p > 0 or o > 0:
-                    local_session.add(Split(expense_id=exp_id, user_id=uid, paid_amount=p, owed_amount=o))
-            
-            local_session.commit()
-            clear_cache()
-            return True, "成功"
+                expense = Expense(id=exp_id, description=desc, amount=total_cents, group_id=group_id, 
+                                  created_by=created_by, category=category, date=final_time)
+                local_session.add(expense)
+                local_session.flush() # 先写入 Expense，保证外键存在
+
+                # 所有分摊一次性批量插入，而不是逐条 add
+                all_users = payer_splits.keys() | ower_splits.keys() # keys 视图直接求并集，不先各建一个 set
+                rows = [{"expense_id": exp_id, "user_id": uid, "paid_amount": payer_splits.get(uid, 0), "owed_amount": ower_splits.get(uid, 0)}
+                        for uid in all_users if payer_splits.get(uid, 0) > 0 or ower_splits.get(uid, 0) > 0]
+                # Core 级 executemany：2.0 下会合并成多值 INSERT，且不经过 ORM 工作单元
+                if rows: local_session.execute(Split.__table__.insert(), rows)
         except Exception as e:
-            local_session.rollback()
             return False, str(e)
-        finally:
-            local_session.close()
+        clear_expense_cache()
+        return True, "成功"
 
     @staticmethod
     def create_repayment(payer_id, receiver_id, amount_cents, group_id, custom_time=None):
@@ -219,59 +315,30 @@ class ExpenseService:
 
     @staticmethod
     def delete_expense(exp_id):
-        local_session = Session()
-        try:
-            exp = local_session.query(Expense).filter_by(id=exp_id).first()
-            if exp:
-                exp.is_deleted = True
-                local_session.commit()
-                clear_cache()
-                return True
-            return False
-        finally:
-            local_session.close()
+        with Session() as local_session, local_session.begin():
+            res = local_session.execute(update(Expense).where(Expense.id == exp_id).values(is_deleted=True))
+        if res.rowcount == 0: return False
+        clear_expense_cache()
+        return True
 
+class DashboardService:
     @staticmethod
-    def get_balances(group_id):
-        local_session = Session()
-        try:
-            expenses = local_session.query(Expense).filter_by(group_id=group_id, is_deleted=False).all()
-            balances = collections.defaultdict(int)
-            for exp in expenses:
-                for s in exp.splits:
-                    balances[s.user.username] += (s.paid_amount - s.owed_amount)
-            return balances
-        finally:
-            local_session.close()
-
-    @staticmethod
-    def get_activity(group_id):
-        local_session = Session()
-        try:
-            return local_session.query(Expense).filter_by(group_id=group_id, is_deleted=False).order_by(Expense.date.desc()).options(joinedload(Expense.creator), joinedload(Expense.splits).joinedload(Split.user)).all()
-        finally:
-            local_session.close()
+    def load_group(group_ids, group_id):
+        # 返回 {"balances": (names, values), "txs": [...], "activity": [...]}；数据按 group_ids 整批查询、缓存
+        return _dashboard_group(group_ids, group_id)
 
 class UserService:
     @staticmethod
     def get_all(): 
-        local_session = Session()
-        try:
-            return local_session.query(User).all()
-        finally:
-            local_session.close()
+        return _all_users_cached()
 
     @staticmethod
     def create(name):
-        local_session = Session()
-        try:
+        with Session() as local_session, local_session.begin():
             if local_session.query(User).filter_by(username=name).first(): return False
-            local_session.add(User(id=str(uuid.uuid4()), username=name))
-            local_session.commit()
-            clear_cache()
-            return True
-        finally:
-            local_session.close()
+            local_session.add(User(id=new_id(), username=name))
+        clear_cache()
+        return True
 
 # ==========================================
 # 🎨 4. 前端 UI (Streamlit)
@@ -280,99 +347,88 @@ st.set_page_config(page_title="Splitwise Ultimate", page_icon="💸", layout="wi
 st.markdown("<style>.big-font {font-size:18px !important;}</style>", unsafe_allow_html=True)
 
 if 'page' not in st.session_state: st.session_state.page = "dashboard"
+# 上一轮写操作留下的提示：用不阻塞的 toast 显示，代替 success + sleep 再 rerun
+if '_flash' in st.session_state: st.toast(st.session_state.pop('_flash'), icon="✅")
 
-# --- 侧边栏 ---
-with st.sidebar:
-    st.title("💸 聚会分账系统")
-    st.caption("v5.2 布局修复版")
-    
-    with st.expander("👤 成员管理", expanded=True):
-        new_u = st.text_input("添加新成员")
-        if st.button("添加"):
-            if new_u:
-                with st.spinner("连接云端..."):
-                    if UserService.create(new_u):
-                        st.success(f"已添加: {new_u}")
-                        time.sleep(0.5)
-                        st.rerun()
-
-    st.divider()
-    all_users = UserService.get_all()
-    if not all_users:
-        st.warning("请先添加成员")
-        st.stop()
-        
-    current_u_name = st.selectbox("当前操作人", [u.username for u in all_users])
-    current_u = next(u for u in all_users if u.username == current_u_name)
-    
-    st.divider()
-    nav = st.radio("功能导航", ["📊 仪表盘 & 动态", "📝 记一笔 (支出)", "💸 还款 (结算)", "⚙️ 设置"])
-
-# --- 1. 仪表盘 & 动态 ---
-if nav == "📊 仪表盘 & 动态":
-    st.header(f"👋 你好, {current_u.username}")
-    
+# --- 页面片段 ---
+# st.fragment 内部的控件交互只重跑该片段，不会把整个脚本 (侧边栏、群组查询) 重跑一遍；
+# 记账成功后的 st.rerun() 仍是整页重跑
+def render_dashboard(current_u):
     with st.spinner("同步账单中..."):
         groups = GroupService.get_active_groups()
     
     if not groups: st.info("暂无群组，请去设置创建")
     
+    group_ids = tuple(g["id"] for g in groups)
     for grp in groups:
-        with st.container(border=True):
-            st.subheader(f"📂 {grp.name}")
-            
-            balances = ExpenseService.get_balances(grp.id)
-            txs = FinanceEngine.simplify_debts(balances)
-            
-            c1, c2 = st.columns(2)
-            with c1:
-                st.markdown("**💰 应付账款**")
-                if not txs: st.caption("账目已平")
-                for t in txs:
-                    st.info(f"👉 **{t['from']}** 需还给 **{t['to']}**: {FinanceEngine.to_dollars(t['amount'])}")
-            with c2:
-                st.markdown("**📊 你的状况**")
-                bal = balances.get(current_u.username, 0)
-                color = "green" if bal >= 0 else "red"
-                txt = f"收回 {FinanceEngine.to_dollars(bal)}" if bal >= 0 else f"支付 {FinanceEngine.to_dollars(abs(bal))}"
-                st.markdown(f":{color}[**需{txt}**]")
-
-            st.divider()
-            
-            st.markdown("**🕒 最近动态**")
-            activities = ExpenseService.get_activity(grp.id)
-            if not activities:
-                st.caption("暂无记录")
-            else:
-                for exp in activities:
-                    time_str = exp.date.strftime('%Y-%m-%d %H:%M')
-                    amt_str = f"{FinanceEngine.to_dollars(exp.amount)}"
-                    
-                    with st.expander(f"{time_str} | {exp.description} - {amt_str}元"):
-                        col_a, col_b = st.columns([4, 1])
-                        with col_a:
-                            st.write(f"创建人: {exp.creator.username}")
-                            st.write(f"分类: {exp.category}")
-                            details = []
-                            for s in exp.splits:
-                                if s.paid_amount > 0: details.append(f"{s.user.username}付{FinanceEngine.to_dollars(s.paid_amount)}")
-                            st.caption(", ".join(details))
-                        with col_b:
-                            if st.button("🗑️ 删除", key=f"del_{exp.id}"):
-                                with st.spinner("删除中..."):
-                                    ExpenseService.delete_expense(exp.id)
-                                    st.rerun()
+        render_group_card(grp, group_ids, current_u)
+
+def delete_activity(group_id, exp_id):
+    # 换一个表格 key 来清掉选中行：否则删除后旧行号会落到下一条记录上，连点两下就删掉两条
+    versions = st.session_state.setdefault("_act_ver", {})
+    versions[group_id] = versions.get(group_id, 0) + 1
+    ExpenseService.delete_expense(exp_id)
+
+@st.fragment
+def render_group_card(grp, group_ids, current_u):
+    # 每张群组卡片单独成片段：在卡片里删除一条记录只重跑这一张卡片。
+    # 片段重跑时参数不变，所以数据在片段内部取 (命中缓存；写操作清缓存后会重新取到最新数据)
+    data = DashboardService.load_group(group_ids, grp["id"])
+    if data is None: return
+
+    with st.container(border=True):
+        st.subheader(f"📂 {grp['name']}")
+        
+        names, balances = data["balances"]
+        txs = data["txs"]
+        
+        c1, c2 = st.columns(2)
+        with c1:
+            st.markdown("**💰 应付账款**")
+            if not txs: st.caption("账目已平")
+            for t in txs:
+                st.info(f"👉 **{t['from']}** 需还给 **{t['to']}**: {t['amount_str']}")
+        with c2:
+            st.markdown("**📊 你的状况**")
+            bal = int(balances[names.index(current_u["username"])]) if current_u["username"] in names else 0
+            color = "green" if bal >= 0 else "red"
+            txt = f"收回 {to_dollars(bal)}" if bal >= 0 else f"支付 {to_dollars(abs(bal))}"
+            st.markdown(f":{color}[**需{txt}**]")
 
-# --- 2. 记一笔 (支出) ---
-elif nav == "📝 记一笔 (支出)":
-    st.header("📝 记录支出")
-    groups = GroupService.get_active_groups()
-    if not groups: st.stop()
-    
-    sel_grp = st.selectbox("选择群组", [g.name for g in groups])
-    grp = next(g for g in groups if g.name == sel_grp)
-    members = [m.user.username for m in grp.members]
-    m_ids = {m.user.username: m.user.id for m in grp.members}
+        st.divider()
+        
+        st.markdown("**🕒 最近动态**")
+        activities = data["activity"]
+        if not activities:
+            st.caption("暂无记录")
+        else:
+            # 整个列表只用一个表格组件，而不是每条记录一个 expander + 按钮；选中一行才渲染明细和删除按钮
+            event = st.dataframe(
+                {"时间": [e["time_str"] for e in activities], "描述": [e["description"] for e in activities],
+                 "金额": [e["amt_str"] for e in activities], "创建人": [e["creator"] for e in activities],
+                 "分类": [e["category"] for e in activities]},
+                key=f"act_{grp['id']}_{st.session_state.get('_act_ver', {}).get(grp['id'], 0)}", hide_index=True, on_select="rerun", selection_mode="single-row")
+            if len(activities) >= ACTIVITY_LIMIT: st.caption(f"仅显示最近 {ACTIVITY_LIMIT} 条记录，更早的记录不在此列出")
+            rows = event.selection.rows
+            if rows and rows[0] < len(activities):
+                exp = activities[rows[0]]
+                col_a, col_b = st.columns([4, 1])
+                with col_a:
+                    st.caption(exp["details"])
+                with col_b:
+                    # 回调在片段重跑之前执行，重跑时缓存已清，直接渲染删除后的数据，不用再 st.rerun()
+                    st.button("🗑️ 删除", key=f"del_{exp['id']}", on_click=delete_activity, args=(grp["id"], exp["id"]))
+
+def member_grid(members, column, default, key, **number_config):
+    # 每人一个数值：用一个 data_editor 表格代替每人一个 number_input，成员多时只渲染一个组件
+    edited = st.data_editor({"成员": members, column: [default] * len(members)}, key=key, hide_index=True,
+                            disabled=["成员"], column_config={column: st.column_config.NumberColumn(**number_config)})
+    return [0 if v is None else v for v in edited[column]]
+
+@st.fragment
+def render_expense_form(grp, current_u):
+    members = grp["member_names"]
+    m_ids = grp["member_ids"]
     
     with st.form("expense"):
         c1, c2, c3 = st.columns(3)
@@ -380,9 +436,9 @@ elif nav == "📝 记一笔 (支出)":
         amt = c2.number_input("总金额", min_value=0.01, step=1.0)
         cat = c3.selectbox("分类", ["餐饮", "交通", "房租", "购物", "娱乐", "其他"])
         
-        c4, c5 = st.columns(2)
-        d_date = c4.date_input("日期", date.today())
-        d_time = c5.time_input("时间", datetime.now().time())
+        # 日期和时间合成一个控件；默认值用 "now" 而不是 datetime.now()，否则每次重跑默认值都变、控件状态被重置
+        # 控件会一直保留首次渲染的时间，保存成功后要 pop 掉它的 key，下一笔才重新取当前时间
+        final_dt = st.datetime_input("日期时间", "now", format="YYYY-MM-DD", step=60, key="exp_dt")
         
         st.divider()
         st.subheader("1. 谁付的钱?")
@@ -390,121 +446,151 @@ elif nav == "📝 记一笔 (支出)":
         payer_splits = {} 
         
         if pay_mode == "单人垫付":
-            payer = st.selectbox("付款人", members, index=members.index(current_u.username) if current_u.username in members else 0)
-            payer_splits[m_ids[payer]] = FinanceEngine.to_cents(amt)
+            payer = st.selectbox("付款人", members, index=members.index(current_u["username"]) if current_u["username"] in members else 0)
+            payer_splits[m_ids[payer]] = to_cents(amt)
         else:
             cols = st.columns(len(members))
             for i, m in enumerate(members):
-                val = cols[i].number_input(f"{m} 付了", min_value=0.0, step=1.0, key=f"pay_{m}")
-                if val > 0: payer_splits[m_ids[m]] = FinanceEngine.to_cents(val)
+                val = cols[i].number_input(f"{m} 付了", min_value=0.0, step=1.0, key=f"pay_{grp['id']}_{m}")
+                if val > 0: payer_splits[m_ids[m]] = to_cents(val)
 
         st.divider()
         st.subheader("2. 怎么分?")
         split_method = st.radio("分账模式", ["🏁 均分", "🔢 按份数", "💯 按百分比", "💵 具体金额"], horizontal=True)
         
-        ower_splits = {}
-        total_cents = FinanceEngine.to_cents(amt)
+        total_cents = to_cents(amt)
         
-        # --- 分账逻辑 UI 修复区域 ---
+        # --- 分账逻辑 UI 修复区域 (只收集原始输入，提交时再计算) ---
         if split_method == "🏁 均分":
             involved = st.multiselect("参与人", members, default=members)
-            if involved:
-                weights = [1] * len(involved)
-                amounts = FinanceEngine.distribute_amount(total_cents, weights)
-                for i, m in enumerate(involved): ower_splits[m_ids[m]] = amounts[i]
 
         elif split_method == "🔢 按份数":
             st.info("💡 例如：A 吃了 2 份，B 吃了 1 份")
-            cols = st.columns(len(members)) # 份数输入框比较短，可以用一行
-            weights = []
-            for i, m in enumerate(members):
-                w = cols[i].number_input(f"{m} (份)", 0, 10, 1 if m in members else 0, key=f"s_{m}")
-                weights.append(w)
-            if sum(weights) > 0:
-                amounts = FinanceEngine.distribute_amount(total_cents, weights)
-                for i, m in enumerate(members): 
-                    if amounts[i] > 0: ower_splits[m_ids[m]] = amounts[i]
+            weights = member_grid(members, "份数", 1, f"s_grid_{grp['id']}", min_value=0, max_value=10, step=1)
 
         elif split_method == "💯 按百分比":
-            cols = st.columns(len(members))
-            pcts = []
-            for i, m in enumerate(members):
-                p = cols[i].number_input(f"{m} (%)", 0.0, 100.0, key=f"p_{m}")
-                pcts.append(p)
-            if abs(sum(pcts)-100) < 0.01:
-                weights = [int(p*100) for p in pcts]
-                amounts = FinanceEngine.distribute_amount(total_cents, weights)
-                for i, m in enumerate(members): 
-                    if amounts[i] > 0: ower_splits[m_ids[m]] = amounts[i]
-            else:
+            pcts = member_grid(members, "百分比 (%)", 0.0, f"p_grid_{grp['id']}", min_value=0.0, max_value=100.0)
+            if abs(sum(pcts)-100) >= 0.01:
                 st.warning(f"当前总和: {sum(pcts)}%，需等于 100%")
 
         elif split_method == "💵 具体金额":
-            st.info("💡 直接输入金额 (界面已优化，防止输入框重叠)")
-            # ✅ 修复：强制换行，每行只放3个，保证输入框够宽
-            cols = st.columns(3)
-            input_sum = 0
-            for i, m in enumerate(members):
-                with cols[i % 3]:
-                    v = st.number_input(f"{m} 应付", min_value=0.0, key=f"e_{m}")
-                    c = FinanceEngine.to_cents(v)
-                    if c > 0:
-                        ower_splits[m_ids[m]] = c
-                        input_sum += c
+            st.info("💡 直接在表格里输入每人应付金额")
+            vals = member_grid(members, "应付", 0.0, f"e_grid_{grp['id']}", min_value=0.0)
+            cents_list = [to_cents(v) for v in vals]
+            input_sum = sum(cents_list)
             
             diff = total_cents - input_sum
             if diff != 0:
-                if diff > 0: st.warning(f"还差 {FinanceEngine.to_dollars(diff)} 元")
-                else: st.error(f"多了 {FinanceEngine.to_dollars(abs(diff))} 元")
+                if diff > 0: st.warning(f"还差 {to_dollars(diff)} 元")
+                else: st.error(f"多了 {to_dollars(abs(diff))} 元")
             else:
                 st.success("✅ 金额匹配")
 
         # --- 提交按钮 ---
         if st.form_submit_button("✅ 确认记账", type="primary"):
+            # 分摊只在提交时计算一次
+            ower_splits = {}
+            if split_method == "🏁 均分":
+                if involved:
+                    amounts = FinanceEngine.distribute_amount(total_cents, [1] * len(involved))
+                    for i, m in enumerate(involved): ower_splits[m_ids[m]] = amounts[i]
+            elif split_method == "🔢 按份数":
+                if sum(weights) > 0:
+                    amounts = FinanceEngine.distribute_amount(total_cents, weights)
+                    for i, m in enumerate(members):
+                        if amounts[i] > 0: ower_splits[m_ids[m]] = amounts[i]
+            elif split_method == "💯 按百分比":
+                if abs(sum(pcts)-100) < 0.01:
+                    amounts = FinanceEngine.distribute_amount(total_cents, [int(p*100) for p in pcts])
+                    for i, m in enumerate(members):
+                        if amounts[i] > 0: ower_splits[m_ids[m]] = amounts[i]
+            elif split_method == "💵 具体金额":
+                for m, c in zip(members, cents_list):
+                    if c > 0: ower_splits[m_ids[m]] = c
+
             if not payer_splits:
                 st.error("必须有付款人")
             elif not ower_splits:
                 st.error("分摊信息不完整")
             else:
                 with st.spinner("保存到云端..."):
-                    final_dt = datetime.combine(d_date, d_time)
-                    success, msg = ExpenseService.create_expense(desc, total_cents, grp.id, current_u.id, cat, payer_splits, ower_splits, final_dt)
+                    success, msg = ExpenseService.create_expense(desc, total_cents, grp["id"], current_u["id"], cat, payer_splits, ower_splits, final_dt)
                     if success:
-                        st.success("保存成功")
-                        time.sleep(0.5)
+                        st.session_state._flash = "保存成功"
+                        st.session_state.pop("exp_dt", None)
                         st.rerun()
                     else:
                         st.error(msg)
 
+# --- 侧边栏 ---
+with st.sidebar:
+    st.title("💸 聚会分账系统")
+    st.caption("v5.2 布局修复版")
+    
+    with st.expander("👤 成员管理", expanded=True):
+        new_u = st.text_input("添加新成员")
+        if st.button("添加"):
+            if new_u:
+                with st.spinner("连接云端..."):
+                    if UserService.create(new_u):
+                        st.session_state._flash = f"已添加: {new_u}"
+                        st.rerun()
+
+    st.divider()
+    all_users = UserService.get_all()
+    if not all_users:
+        st.warning("请先添加成员")
+        st.stop()
+        
+    # 直接以 dict 作为选项，format_func 负责显示名字，省掉 名字 -> 对象 的二次查找
+    current_u = st.selectbox("当前操作人", all_users, format_func=lambda u: u["username"])
+    
+    st.divider()
+    nav = st.radio("功能导航", ["📊 仪表盘 & 动态", "📝 记一笔 (支出)", "💸 还款 (结算)", "⚙️ 设置"])
+
+# --- 1. 仪表盘 & 动态 ---
+if nav == "📊 仪表盘 & 动态":
+    st.header(f"👋 你好, {current_u['username']}")
+    
+    render_dashboard(current_u)
+
+# --- 2. 记一笔 (支出) ---
+elif nav == "📝 记一笔 (支出)":
+    st.header("📝 记录支出")
+    groups = GroupService.get_active_groups()
+    if not groups: st.stop()
+    
+    # 群组选择放进单独的表单，点"切换"才提交，翻看下拉框不会触发整页重跑
+    with st.form("grp_pick"):
+        grp = st.selectbox("选择群组", groups, format_func=lambda g: g["name"])
+        st.form_submit_button("切换群组")
+    render_expense_form(grp, current_u)
+
 # --- 3. 还款 (结算) ---
 elif nav == "💸 还款 (结算)":
     st.header("💸 记录还款")
     groups = GroupService.get_active_groups()
     if not groups: st.stop()
     
-    sel_grp_s = st.selectbox("选择群组", [g.name for g in groups], key="settle_grp")
-    grp_s = next(g for g in groups if g.name == sel_grp_s)
-    members_s = [m.user.username for m in grp_s.members]
-    m_ids_s = {m.user.username: m.user.id for m in grp_s.members}
+    grp_s = st.selectbox("选择群组", groups, format_func=lambda g: g["name"], key="settle_grp")
+    members_s = grp_s["member_names"]
+    m_ids_s = grp_s["member_ids"]
     
     c1, c2, c3 = st.columns(3)
     payer_s = c1.selectbox("付款人 (谁还钱)", members_s, index=0)
     receiver_s = c2.selectbox("收款人 (还给谁)", members_s, index=1 if len(members_s)>1 else 0)
     amt_s = c3.number_input("还款金额", min_value=0.01, step=1.0)
     
-    c4, c5 = st.columns(2)
-    s_date = c4.date_input("还款日期", date.today())
-    s_time = c5.time_input("还款时间", datetime.now().time())
+    final_dt_s = st.datetime_input("还款时间", "now", format="YYYY-MM-DD", step=60, key="settle_dt")
 
     if st.button("✅ 确认还款", type="primary"):
         if payer_s == receiver_s:
             st.error("不能自己还自己")
         else:
-            final_dt_s = datetime.combine(s_date, s_time)
             ExpenseService.create_repayment(m_ids_s[payer_s], m_ids_s[receiver_s], 
-                                          FinanceEngine.to_cents(amt_s), grp_s.id, final_dt_s)
-            st.success(f"已记录：{payer_s} 还给 {receiver_s} {amt_s}元")
-            time.sleep(1)
+                                          to_cents(amt_s), grp_s["id"], final_dt_s)
+            st.session_state._flash = f"已记录：{payer_s} 还给 {receiver_s} {amt_s}元"
+            st.session_state.pop("settle_dt", None)
             st.rerun()
 
 # --- 4. 设置 ---
@@ -512,21 +598,23 @@ elif nav == "⚙️ 设置":
     st.subheader("群组管理")
     with st.expander("➕ 新建群组"):
         n_grp = st.text_input("群名")
-        others = [u.username for u in all_users if u.username != current_u.username]
-        invites = st.multiselect("拉人", others)
+        others = [u for u in all_users if u["id"] != current_u["id"]]
+        invites = st.multiselect("拉人", others, format_func=lambda u: u["username"])
         if st.button("建群"):
             if n_grp:
                 with st.spinner("创建中..."):
-                    uids = [u.id for u in all_users if u.username in invites + [current_u.username]]
+                    uids = [u["id"] for u in invites + [current_u]]
                     GroupService.create_group(n_grp, uids)
-                    st.success("成功")
+                    st.session_state._flash = f"已创建群组: {n_grp}"
                     st.rerun()
 
     groups = GroupService.get_active_groups()
     if groups:
-        d_g = st.selectbox("删除群组", [g.name for g in groups])
+        d_g = st.selectbox("删除群组", groups, format_func=lambda g: g["name"])
         if st.button("确认删除"):
             with st.spinner("删除中..."):
-                t_g = next(g for g in groups if g.name == d_g)
-                GroupService.delete_group(t_g.id)
-                st.rerun()
\ No newline at end of file
+                GroupService.delete_group(d_g["id"])
+                st.rerun()
+
+# 本轮脚本结束，释放当前线程的 scoped session
+Session.remove()
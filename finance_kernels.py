@@ -0,0 +1,57 @@
+# 分账/结算的 int64 数值内核。
+# 单独成模块：Streamlit 每次交互都会重新执行 app.py，而被 import 的模块每个进程只加载一次，
+# 所以 JIT 编译 (或读磁盘缓存) 和预热也只发生一次。
+import numpy as np
+
+# numba 为可选加速：装了就 JIT 编译数值内核，没装 (如 Streamlit Cloud 默认环境) 则按纯 Python 运行
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+def distribute_core(total_cents, weights):
+    # 最大余数法：先按比例向下取整，剩下的几分补给被截掉最多的几位，全程无浮点
+    total_weight = weights.sum()
+    products = total_cents * weights
+    amounts = products // total_weight
+    remainder = total_cents - amounts.sum()
+    if remainder > 0:
+        # 稳定排序：截掉的部分相同时靠前者优先，结果可复现；权重为 0 的人不会分到零头
+        order = np.argsort(-(products - amounts * total_weight), kind="mergesort")
+        amounts[order[:remainder]] += 1
+    return amounts
+
+def simplify_core(balances):
+    # 排序一次后双指针扫描：欠款从最多往少走，应收从最多往少走，余额不用再重新入堆
+    # 输入已按名字排序，稳定排序保证金额相同时名字靠前者优先
+    n = len(balances)
+    bal = balances.copy()
+    debtors = np.argsort(bal, kind="mergesort")
+    creditors = np.argsort(-bal, kind="mergesort")
+    from_idx = np.empty(n, dtype=np.int64)
+    to_idx = np.empty(n, dtype=np.int64)
+    amounts = np.empty(n, dtype=np.int64)
+    count = 0
+    i = 0
+    j = 0
+    while i < n and j < n:
+        d = debtors[i]
+        c = creditors[j]
+        if bal[d] >= -1 or bal[c] <= 1: break
+        amount = min(-bal[d], bal[c])
+        from_idx[count] = d
+        to_idx[count] = c
+        amounts[count] = amount
+        count += 1
+        bal[d] += amount
+        bal[c] -= amount
+        if bal[d] >= -1: i += 1
+        if bal[c] <= 1: j += 1
+    return from_idx[:count], to_idx[:count], amounts[:count]
+
+if njit is not None:
+    distribute_core = njit(cache=True)(distribute_core)
+    simplify_core = njit(cache=True)(simplify_core)
+    # 预热 JIT：首次导入时编译 (cache=True 时后续进程直接读磁盘缓存)
+    distribute_core(np.int64(100), np.ones(3, dtype=np.int64))
+    simplify_core(np.array([-100, 100], dtype=np.int64))